@@ -2,17 +2,22 @@
 
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
-from .models import Base, Video, Plate
+from .models import Base, Video, Plate, BatchSetting
 from datetime import datetime
 
 def init_db(db_path):
     """
     Initialize (and create if not exists) the SQLite database.
-    :param db_path: Path to the SQLite database file.
+    :param db_path: Path to the SQLite database file, or a full SQLAlchemy database URL.
     :return: session
     """
-    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    if "://" in db_path:
+        engine = create_engine(db_path, echo=False)
+    else:
+        # Several worker processes may share the file, so wait for locks instead of failing
+        engine = create_engine(f"sqlite:///{db_path}", echo=False, connect_args={"timeout": 30})
     # Create all tables if they don't exist
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine)
@@ -32,6 +37,18 @@ def insert_video_record(session, url, local_path, processing_date):
     session.commit()
     return video.id
 
+def delete_video_record(session, video_id):
+    """
+    Delete a video record and its plates, e.g. the partial results of an aborted analysis.
+    :param session: db session
+    :param video_id: int, or None (nothing to delete)
+    """
+    if video_id is None:
+        return
+    session.query(Plate).filter(Plate.video_id == video_id).delete(synchronize_session=False)
+    session.query(Video).filter(Video.id == video_id).delete(synchronize_session=False)
+    session.commit()
+
 def insert_plate_record(session, video_id, timestamp, plate_text, confidence, bbox):
     """
     Insert a new plate record.
@@ -51,3 +68,44 @@ def insert_plate_record(session, video_id, timestamp, plate_text, confidence, bb
     )
     session.add(plate)
     session.commit()
+
+
+def get_batch_setting(session, host, model_path, devices):
+    """
+    Return the persisted batch tuning result for a host, model and devices, or None.
+    :param devices: str, comma separated device list
+    """
+    return session.query(BatchSetting).filter(
+        BatchSetting.host == host,
+        BatchSetting.model_path == model_path,
+        BatchSetting.devices == devices
+    ).first()
+
+def save_batch_setting(session, host, model_path, devices, batch_size, throughput):
+    """
+    Insert or update the batch tuning result for a host, model and devices.
+    :param throughput: float, measured frames per second, or None to keep the previous measurement
+    """
+    setting = get_batch_setting(session, host, model_path, devices)
+    if setting is None:
+        session.add(BatchSetting(
+            host=host,
+            model_path=model_path,
+            devices=devices,
+            batch_size=batch_size,
+            throughput=throughput,
+            updated_at=datetime.now()
+        ))
+        try:
+            session.commit()
+            return
+        except IntegrityError:
+            # Another worker inserted the row first, update that one instead
+            session.rollback()
+            setting = get_batch_setting(session, host, model_path, devices)
+
+    setting.batch_size = batch_size
+    if throughput is not None:
+        setting.throughput = throughput
+    setting.updated_at = datetime.now()
+    session.commit()
@@ -0,0 +1,195 @@
+# db/job_queue.py
+
+from datetime import timedelta, timezone
+from sqlalchemy import or_, and_, update, func, select
+from .models import Job
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def db_now(session):
+    """
+    Current time of the database as naive UTC.
+    Leases and backoff are based on this clock, so workers on hosts with other
+    time zones or skewed clocks agree on when a lease expires.
+    """
+    now = session.scalar(select(func.current_timestamp()))
+    if now.tzinfo is not None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    return now
+
+def enqueue_job(session, url=None, local_path=None, max_attempts=3, force=False):
+    """
+    Add a video to the job queue.
+    Unless force is set, a video that is already queued, running or done is not queued again.
+    :param session: db session
+    :param url: str, video URL
+    :param local_path: str, local video file
+    :param max_attempts: int, how often the job is tried before it is marked as failed
+    :param force: bool, queue the video even if a job for it already exists
+    :return: int (job_id), or None if the video was already queued
+    """
+    if not force:
+        source_filter = Job.url == url if url else Job.local_path == local_path
+        existing = session.query(Job).filter(source_filter, Job.status != FAILED).first()
+        if existing:
+            return None
+
+    job = Job(
+        url=url,
+        local_path=local_path,
+        status=PENDING,
+        attempts=0,
+        max_attempts=max_attempts,
+        enqueued_at=db_now(session)
+    )
+    session.add(job)
+    session.commit()
+    return job.id
+
+def _retry_values(job, now, backoff_seconds, max_backoff_seconds):
+    """
+    Column values after a failed attempt: retry with exponential backoff, or give up after max_attempts.
+    """
+    if job.attempts >= job.max_attempts:
+        return dict(status=FAILED, finished_at=now, lease_expires_at=None)
+    delay = min(backoff_seconds * 2 ** (job.attempts - 1), max_backoff_seconds)
+    return dict(status=PENDING, finished_at=now, lease_expires_at=None, next_attempt_at=now + timedelta(seconds=delay))
+
+def expire_leases(session, backoff_seconds=30, max_backoff_seconds=3600):
+    """
+    Count running jobs whose lease expired as failed attempts, because their worker died or hung.
+    Like fail_job, they are retried with backoff or marked as failed after max_attempts,
+    so a video that keeps killing its worker does not take down every worker in turn.
+    :return: int, number of expired jobs
+    """
+    now = db_now(session)
+    expired = session.query(Job).filter(Job.status == RUNNING, Job.lease_expires_at < now).all()
+    count = 0
+    for job in expired:
+        values = _retry_values(job, now, backoff_seconds, max_backoff_seconds)
+        values["last_error"] = f"Lease of worker {job.worker_id} expired"
+        result = session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == RUNNING, Job.lease_expires_at < now, Job.attempts == job.attempts)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        count += result.rowcount
+    session.commit()
+    return count
+
+def claim_job(session, worker_id, lease_seconds=600, backoff_seconds=30):
+    """
+    Claim the next runnable job for a worker: a pending job whose backoff has passed.
+    Expired leases are handled first, see expire_leases.
+    The claim is a conditional UPDATE, so concurrent workers never get the same job.
+    :param session: db session
+    :param worker_id: str, identifies the claiming worker (host and pid)
+    :param lease_seconds: int, how long the lease is valid without being renewed
+    :param backoff_seconds: int, base delay before a job with an expired lease is retried
+    :return: Job, or None if nothing is runnable
+    """
+    expire_leases(session, backoff_seconds=backoff_seconds)
+    while True:
+        now = db_now(session)
+        runnable = and_(Job.status == PENDING, or_(Job.next_attempt_at.is_(None), Job.next_attempt_at <= now))
+        candidate = session.query(Job.id).filter(runnable).order_by(Job.id).first()
+        if candidate is None:
+            return None
+
+        result = session.execute(
+            update(Job)
+            .where(Job.id == candidate.id, runnable)
+            .values(
+                status=RUNNING,
+                worker_id=worker_id,
+                attempts=Job.attempts + 1,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                started_at=now
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        if result.rowcount == 1:
+            return session.get(Job, candidate.id)
+        # Another worker claimed it first, try the next one
+
+def renew_lease(session, job_id, worker_id, lease_seconds=600):
+    """
+    Extend the lease of a running job.
+    :return: bool, False if the job is no longer leased by this worker
+    """
+    result = session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.worker_id == worker_id, Job.status == RUNNING)
+        .values(lease_expires_at=db_now(session) + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount == 1
+
+def complete_job(session, job_id, worker_id, video_id, processing_seconds, video_duration):
+    """
+    Mark a job as done and record its timing, if the worker still holds the lease.
+    :param worker_id: str, the worker that claimed the job
+    :param video_id: int, ID of the video record created by the analysis
+    :param processing_seconds: float
+    :param video_duration: float, or None if it could not be determined
+    :return: bool, False if the job is no longer leased by this worker and nothing was written
+    """
+    result = session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.worker_id == worker_id, Job.status == RUNNING)
+        .values(
+            status=DONE,
+            video_id=video_id,
+            finished_at=db_now(session),
+            processing_seconds=processing_seconds,
+            video_duration=video_duration,
+            lease_expires_at=None,
+            last_error=None
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount == 1
+
+def fail_job(session, job_id, worker_id, error, backoff_seconds=30, max_backoff_seconds=3600):
+    """
+    Record a failed attempt, if the worker still holds the lease. The job is retried with
+    exponential backoff until it has used up max_attempts, after which it is marked as failed.
+    :param worker_id: str, the worker that claimed the job
+    :param error: str, description of the failure
+    :return: bool, False if the job is no longer leased by this worker and nothing was written
+    """
+    job = session.get(Job, job_id)
+    values = _retry_values(job, db_now(session), backoff_seconds, max_backoff_seconds)
+    values["last_error"] = error
+
+    # attempts is part of the condition, so a reclaim between the read above and this update is detected
+    result = session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.worker_id == worker_id, Job.status == RUNNING, Job.attempts == job.attempts)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount == 1
+
+def has_unfinished_jobs(session):
+    """
+    Return True if any job is still pending or running.
+    """
+    return session.query(Job.id).filter(Job.status.in_([PENDING, RUNNING])).first() is not None
+
+def job_counts(session):
+    """
+    Return the number of jobs per status as a dict.
+    """
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    for status, count in session.query(Job.status, func.count(Job.id)).group_by(Job.status):
+        counts[status] = count
+    return counts
@@ -1,7 +1,7 @@
 # db/models.py
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import relationship, validates
 
 Base = declarative_base()
@@ -15,6 +15,7 @@ class Video(Base):
     processing_date = Column(DateTime, nullable=True)
 
     plates = relationship("Plate", back_populates="video")
+    jobs = relationship("Job", back_populates="video")
 
 class Plate(Base):
     __tablename__ = "plates"
@@ -30,4 +31,47 @@ class Plate(Base):
 
     @validates('plate_text')
     def convert_upper(self, key, value):
-        return value.upper()
\ No newline at end of file
+        return value.upper()
+
+class Job(Base):
+    """
+    A queued video analysis job, claimed by workers through a time-limited lease.
+    status is one of 'pending', 'running', 'done' or 'failed'.
+    All times are taken from the database clock, in UTC.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    url = Column(String, nullable=True)
+    local_path = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="pending", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    enqueued_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    processing_seconds = Column(Float, nullable=True)
+    video_duration = Column(Float, nullable=True)
+    last_error = Column(Text, nullable=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=True)
+
+    video = relationship("Video", back_populates="jobs")
+
+class BatchSetting(Base):
+    """
+    Batch size found by the batch tuner for a host, model and set of devices.
+    The frame queue depth is derived from it (see BatchTuner.queue_depth).
+    """
+    __tablename__ = "batch_settings"
+    __table_args__ = (UniqueConstraint("host", "model_path", "devices"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    host = Column(String, nullable=False)
+    model_path = Column(String, nullable=False)
+    devices = Column(String, nullable=False)
+    batch_size = Column(Integer, nullable=False)
+    throughput = Column(Float, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
\ No newline at end of file
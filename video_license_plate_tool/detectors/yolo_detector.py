@@ -1,64 +1,195 @@
 # detectors/yolo_detector.py
+from concurrent.futures import ThreadPoolExecutor, wait
+import math
+import os
+import queue
+import threading
 from ultralytics import YOLO
+from ultralytics.nn.autobackend import AutoBackend
+from ultralytics.yolo.v8.detect.predict import DetectionPredictor
 import cv2
 import torch
 
+def resolve_devices(devices=None, cpu_replicas=None):
+    """
+    Work out which devices get a model replica.
+    :param devices: list of device strings (e.g. ['cuda:0', 'cuda:1'] or ['cpu', 'cpu']), or a comma separated string.
+                    If None, one replica is placed on every visible GPU, or on CPU replicas if there is no GPU.
+    :param cpu_replicas: int, number of CPU replicas when falling back to CPU, or when devices is just 'cpu'.
+                         Defaults to one per 4 CPU cores.
+    :return: list of device strings, one per replica
+    """
+    if isinstance(devices, str):
+        devices = [d.strip() for d in devices.split(",") if d.strip()]
+    if devices == ["cpu"] and cpu_replicas:
+        return ["cpu"] * cpu_replicas
+    if devices:
+        return [f"cuda:{d}" if d.isdigit() else d for d in devices]
+
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+
+    if cpu_replicas is None:
+        cpu_replicas = max(1, (os.cpu_count() or 1) // 4)
+    return ["cpu"] * cpu_replicas
+
+def split_devices(devices, workers):
+    """
+    Divide the replica devices of one host between several worker processes, so the workers
+    do not each load a model on every GPU, or run more CPU threads together than there are cores.
+    :param devices: list of device strings, see resolve_devices
+    :param workers: int, number of worker processes
+    :return: list with a tuple (device strings, intra-op threads per CPU replica or None) per worker
+    """
+    # With more workers than devices, some devices are shared
+    shares = [devices[i::workers] or [devices[i % len(devices)]] for i in range(workers)]
+    cpu_replicas = sum(share.count("cpu") for share in shares)
+    cpu_threads = max(1, (os.cpu_count() or 1) // cpu_replicas) if cpu_replicas else None
+    return [(share, cpu_threads) for share in shares]
+
+class DevicePredictor(DetectionPredictor):
+    """
+    A DetectionPredictor that runs on a fixed torch.device.
+    Ultralytics' own device selection turns a GPU index into CUDA_VISIBLE_DEVICES for the whole
+    process and then uses cuda:0, which puts every replica on the first GPU once CUDA is initialized.
+    """
+
+    def __init__(self, device, overrides=None, _callbacks=None):
+        super().__init__(overrides=overrides, _callbacks=_callbacks)
+        self.fixed_device = device
+
+    def setup_model(self, model, verbose=True):
+        model = model or self.args.model
+        self.args.half &= self.fixed_device.type != "cpu"  # half precision only supported on CUDA
+        self.model = AutoBackend(model, device=self.fixed_device, dnn=self.args.dnn, data=self.args.data,
+                                 fp16=self.args.half, fuse=True, verbose=verbose)
+        self.device = self.fixed_device
+        self.model.eval()
+
+class _Replica:
+    """
+    One copy of the YOLO model on a single device.
+    """
+
+    def __init__(self, model_path, device):
+        self.device = torch.device(device)
+        self.device_type = self.device.type
+        self.lock = threading.Lock()
+
+        self.model = YOLO(model_path)
+
+        # Install the predictor before the first predict call, so YOLO.predict uses it
+        # instead of creating one on the default device. Half precision if using GPU.
+        predictor = DevicePredictor(
+            self.device,
+            overrides={"mode": "predict", "save": False, "imgsz": 960, "half": self.device_type == "cuda"},
+            _callbacks=self.model.callbacks
+        )
+        predictor.setup_model(model=self.model.model, verbose=False)
+        self.model.predictor = predictor
+
+    def predict(self, rgb_frames, conf_threshold):
+        with self.lock, torch.amp.autocast(device_type=self.device_type):
+            return self.model.predict(source=rgb_frames, imgsz=960, conf=conf_threshold)
+
 class YoloPlateDetector:
     """
     A YOLO-based license plate detector optimized for GPU with mixed precision.
+    Batches are sharded over one model replica per device.
     """
 
-    def __init__(self, model_path="plate_detection.pt", conf_threshold=0.5):
+    def __init__(self, model_path="plate_detection.pt", conf_threshold=0.5, devices=None, cpu_replicas=None, cpu_threads=None):
+        """
+        :param model_path: str, path to the YOLO weights
+        :param conf_threshold: float, minimum detection confidence
+        :param devices: list or comma separated string of devices, see resolve_devices
+        :param cpu_replicas: int, number of CPU replicas on hosts without a GPU
+        :param cpu_threads: int, intra-op threads per CPU replica. Defaults to the CPU cores divided over the replicas.
+        """
         self.model_path = model_path
         self.conf_threshold = conf_threshold
-        
-        # Load the YOLO model and move it to GPU if available
-        self.model = YOLO(self.model_path)
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model.model.to(device)
+        self.devices = resolve_devices(devices, cpu_replicas)
 
-        # Set model to half precision if using GPU
-        if device == 'cuda':
-            self.model.model.half()
+        # Torch's intra-op thread pool is shared by the whole process, so limit it such that
+        # the CPU replicas running side by side do not oversubscribe the cores
+        cpu_count = self.devices.count("cpu")
+        if cpu_count > 1 or cpu_threads:
+            torch.set_num_threads(cpu_threads or max(1, (os.cpu_count() or 1) // cpu_count))
+
+        # Load one model replica per device
+        self.replicas = [_Replica(self.model_path, device) for device in self.devices]
+        self.executor = None
+        if len(self.replicas) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.replicas), thread_name_prefix="yolo-replica")
 
         # Export the model to TFLite format
         # self.model.export(format='tflite')
         # self.model = YOLO(self.model_path.replace('.pt', '.onnx'))  # load TFLite model
 
+    @property
+    def model(self):
+        """
+        The model of the first replica.
+        """
+        return self.replicas[0].model
+
     def detect_plates(self, frame):
         """
         Runs detection on a single frame with mixed precision.
         """
-        # Convert frame to RGB as YOLO expects
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Use torch.autocast for mixed precision inference on GPU
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        with torch.cuda.amp.autocast(enabled=(device == 'cuda')):
-            results = self.model.predict(source=rgb_frame, imgsz=960, conf=self.conf_threshold)
-
-        detections = []
-        for box in results[0].boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            conf = box.conf[0].item()
-            detections.append((x1, y1, x2, y2, conf))
-        return detections
-
-    def detect_batch(self, frames):
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames, shard_size=None):
         """
         Runs detection on a batch of frames.
+        With several replicas the batch is split into shards which the replicas take from a shared
+        queue, so a faster device simply processes more shards.
         :param frames: list of np.ndarray frames in BGR format.
+        :param shard_size: int, frames per shard. Defaults to an even split over the replicas.
         :return: list of detections for each frame, where each detection is a list of (x1, y1, x2, y2, confidence).
         """
         # Convert each frame to RGB
         rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
-        
-        # Determine device type for autocast
-        device_type = 'cuda' if torch.cuda.is_available() else 'cpu'
+        if not rgb_frames:
+            return []
+
+        if self.executor is None:
+            return self._predict(self.replicas[0], rgb_frames)
+
+        if shard_size is None:
+            shard_size = math.ceil(len(rgb_frames) / len(self.replicas))
+        shards = queue.Queue()
+        for start in range(0, len(rgb_frames), shard_size):
+            shards.put(start)
+
+        all_detections = [None] * len(rgb_frames)
+        failed = threading.Event()
+
+        def drain(replica):
+            while not failed.is_set():
+                try:
+                    start = shards.get_nowait()
+                except queue.Empty:
+                    return
+                shard = rgb_frames[start:start + shard_size]
+                try:
+                    all_detections[start:start + len(shard)] = self._predict(replica, shard)
+                except Exception:
+                    # Let the other replicas stop after their current shard
+                    failed.set()
+                    raise
+
+        futures = [self.executor.submit(drain, replica) for replica in self.replicas]
+        # Wait for every replica before raising, so no shard is still running on a
+        # device when the caller retries (e.g. with smaller batches after running out of memory)
+        wait(futures)
+        for future in futures:
+            future.result()
+        return all_detections
+
+    def _predict(self, replica, rgb_frames):
+        results = replica.predict(rgb_frames, self.conf_threshold)
 
-        with torch.amp.autocast(device_type=device_type):
-            results = self.model.predict(source=rgb_frames, imgsz=960, conf=self.conf_threshold)
-        
         all_detections = []
         for result in results:
             detections = []
@@ -68,3 +199,11 @@ class YoloPlateDetector:
                 detections.append((x1, y1, x2, y2, conf))
             all_detections.append(detections)
         return all_detections
+
+    def close(self):
+        """
+        Stop the replica threads.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -1,14 +1,17 @@
 import argparse
 import os
+import socket
+import subprocess
 import sys
 import cv2  # OpenCV for duration calculation
 from datetime import datetime
 
 from pytube import Playlist, Channel  # For playlist and channel processing
 
-from utils import video_downloader, video_reader, config
-from db import db_utils
-from detectors.yolo_detector import YoloPlateDetector
+from utils import video_downloader, video_reader, config, job_worker
+from utils.batch_tuner import BatchTuner
+from db import db_utils, job_queue
+from detectors.yolo_detector import YoloPlateDetector, resolve_devices, split_devices
 from ocr.ocr_utils import extract_text_from_image
 from db.models import Video
 
@@ -28,7 +31,8 @@ def get_video_duration(video_path):
     else:
         return None
 
-def process_single_video(db_session, video_url, video_path, confidence_threshold, frame_skip, force, skip):
+def process_single_video(db_session, video_url, video_path, confidence_threshold, frame_skip, force, skip, devices=None, cpu_replicas=None,
+                         cpu_threads=None, batch_tuning=None):
     """
     Process a single video given by video_url or video_path.
     Applies reprocessing logic based on the 'force' flag.
@@ -56,6 +60,37 @@ def process_single_video(db_session, video_url, video_path, confidence_threshold
                 print("Skipping video processing.")
                 return
 
+    try:
+        video_id, total_processing_time, video_duration = analyze_video(
+            db_session, video_url, video_path, confidence_threshold, frame_skip, devices, cpu_replicas,
+            cpu_threads=cpu_threads, batch_tuning=batch_tuning
+        )
+    except OSError as e:
+        # Continue with the next video, as before
+        print(f"[ERROR] {e}")
+        return
+
+    print("[INFO] Processing complete.")
+    print(f"[INFO] Total processing time: {total_processing_time}")
+    if video_duration is not None:
+        hours = int(video_duration // 3600)
+        minutes = int((video_duration % 3600) // 60)
+        seconds = int(video_duration % 60)
+        print(f"[INFO] Total video duration: {hours:02d}:{minutes:02d}:{seconds:02d} (HH:MM:SS)")
+    else:
+        print("[WARN] Unable to determine video duration.")
+
+def analyze_video(db_session, video_url, video_path, confidence_threshold, frame_skip, devices=None, cpu_replicas=None,
+                  cpu_threads=None, batch_tuning=None, stop_event=None):
+    """
+    Run detection and OCR on a local video and store the results.
+    :param batch_tuning: dict of keyword arguments for make_batch_tuner to tune the batch size while processing,
+                         or None to use the fixed video_reader.batch_size
+    :param stop_event: optional threading.Event that stops processing early; a stopped analysis raises RuntimeError
+    A video file that cannot be opened raises OSError.
+    If the analysis fails, the video record and its plates are deleted again.
+    :return: tuple (video_id, total_processing_time as timedelta, video duration in seconds or None)
+    """
     # Record start time for processing
     start_time = datetime.now()
 
@@ -68,17 +103,45 @@ def process_single_video(db_session, video_url, video_path, confidence_threshold
     )
 
     # Initialize plate detector
-    plate_detector = YoloPlateDetector(model_path=config.DEFAULT_MODEL_PATH, conf_threshold=confidence_threshold)
+    plate_detector = YoloPlateDetector(
+        model_path=config.DEFAULT_MODEL_PATH,
+        conf_threshold=confidence_threshold,
+        devices=devices,
+        cpu_replicas=cpu_replicas,
+        cpu_threads=cpu_threads
+    )
+
+    # Measure and adjust the batch size while processing if requested
+    tuner = make_batch_tuner(db_session, plate_detector, **batch_tuning) if batch_tuning is not None else None
 
     # Process video frames
-    video_reader.process_video(
-        video_path=video_path,
-        detector=plate_detector,
-        ocr_function=extract_text_from_image,
-        db_session=db_session,
-        video_id=video_id,
-        frame_skip=frame_skip
-    )
+    try:
+        finished = video_reader.process_video(
+            video_path=video_path,
+            detector=plate_detector,
+            ocr_function=extract_text_from_image,
+            db_session=db_session,
+            video_id=video_id,
+            frame_skip=frame_skip,
+            tuner=tuner,
+            stop_event=stop_event
+        )
+        if stop_event is not None and stop_event.is_set():
+            raise RuntimeError(f"Processing of {video_url or video_path} was stopped")
+        if not finished:
+            raise OSError(f"Cannot open video: {video_path}")
+    except Exception:
+        # Remove the partial results, so a retry does not add duplicate plates
+        # and the video does not count as processed
+        db_session.rollback()
+        db_utils.delete_video_record(db_session, video_id)
+        raise
+    finally:
+        # Stop the replica threads, also when the analysis failed
+        plate_detector.close()
+
+    if tuner is not None:
+        save_batch_tuner(db_session, plate_detector, tuner)
 
     # Record end time after processing
     end_time = datetime.now()
@@ -89,15 +152,95 @@ def process_single_video(db_session, video_url, video_path, confidence_threshold
     # Get video duration
     video_duration = get_video_duration(video_path)
 
-    print("[INFO] Processing complete.")
-    print(f"[INFO] Total processing time: {total_processing_time}")
-    if video_duration is not None:
-        hours = int(video_duration // 3600)
-        minutes = int((video_duration % 3600) // 60)
-        seconds = int(video_duration % 60)
-        print(f"[INFO] Total video duration: {hours:02d}:{minutes:02d}:{seconds:02d} (HH:MM:SS)")
-    else:
-        print("[WARN] Unable to determine video duration.")
+    return video_id, total_processing_time, video_duration
+
+def make_batch_tuner(db_session, plate_detector, batch_size, max_latency=None, memory_limit_mb=None, retune=False):
+    """
+    Create a batch tuner for this host, model and devices.
+    It starts from the persisted optimum of an earlier run, unless retune is set.
+    :param batch_size: int, batch size to start exploring from when nothing was persisted
+    :param max_latency: float, maximum seconds per batch, or None
+    :param memory_limit_mb: float, memory budget for frames in flight, or None
+    :param retune: bool, ignore the persisted optimum and measure again
+    """
+    setting = None
+    if not retune:
+        setting = db_utils.get_batch_setting(
+            db_session, socket.gethostname(), plate_detector.model_path, ",".join(plate_detector.devices)
+        )
+    if setting is not None:
+        print(f"[INFO] Using tuned batch size {setting.batch_size}")
+
+    return BatchTuner(
+        batch_size=setting.batch_size if setting else batch_size,
+        max_latency=max_latency,
+        memory_limit_mb=memory_limit_mb,
+        settled=setting is not None
+    )
+
+def save_batch_tuner(db_session, plate_detector, tuner):
+    """
+    Persist the batch size once the tuner has settled on a measured value.
+    """
+    if not tuner.settled or not tuner.measured:
+        return
+    print(f"[INFO] Saving tuned batch size {tuner.batch_size} (queue depth {tuner.queue_depth})")
+    db_utils.save_batch_setting(
+        db_session,
+        host=socket.gethostname(),
+        model_path=plate_detector.model_path,
+        devices=",".join(plate_detector.devices),
+        batch_size=tuner.batch_size,
+        throughput=tuner.throughput
+    )
+
+def process_job(db_session, job, lease_lost, confidence_threshold, frame_skip, devices=None, cpu_replicas=None,
+                cpu_threads=None, batch_tuning=None):
+    """
+    Process a queued job without any prompts. Exceptions are left to the worker, which retries the job.
+    :param lease_lost: threading.Event set by the worker when another worker took over the job
+    :return: tuple (video_id, processing time in seconds, video duration in seconds or None)
+    """
+    video_url, video_path = job.url, job.local_path
+    if video_url and not video_path:
+        print(f"[INFO] Downloading video from: {video_url}")
+        video_path = video_downloader.download_video(video_url, "downloads")
+        print(f"[INFO] Video downloaded to: {video_path}")
+    if not video_path or not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    video_id, total_processing_time, video_duration = analyze_video(
+        db_session, video_url, video_path, confidence_threshold, frame_skip, devices, cpu_replicas,
+        cpu_threads=cpu_threads, batch_tuning=batch_tuning, stop_event=lease_lost
+    )
+    return video_id, total_processing_time.total_seconds(), video_duration
+
+def start_local_workers(count, args):
+    """
+    Start count worker processes on this host by re-running this script with --worker.
+    The devices of the host are divided between the workers, see split_devices.
+    :param args: parsed command line options, passed on to the workers
+    :return: int, the highest exit code of the workers
+    """
+    worker_args = [sys.executable, os.path.abspath(__file__), "--worker"]
+    for name in ("db", "confidence_threshold", "frame_skip", "lease_seconds", "poll_interval", "retry_backoff"):
+        worker_args += [f"--{name}", str(getattr(args, name))]
+    for name in ("batch_size", "max_batch_latency", "memory_limit_mb"):
+        if getattr(args, name) is not None:
+            worker_args += [f"--{name}", str(getattr(args, name))]
+    for name in ("keep_polling", "auto_batch", "retune"):
+        if getattr(args, name):
+            worker_args.append(f"--{name}")
+
+    processes = []
+    devices = resolve_devices(args.devices, args.cpu_replicas)
+    for share, cpu_threads in split_devices(devices, count):
+        print(f"[INFO] Starting worker on {','.join(share)}")
+        device_args = ["--devices", ",".join(share)]
+        if cpu_threads is not None:
+            device_args += ["--cpu_threads", str(args.cpu_threads or cpu_threads)]
+        processes.append(subprocess.Popen(worker_args + device_args))
+    return max(process.wait() for process in processes)
 
 parser = argparse.ArgumentParser(
     description="License Plate Detection and OCR from YouTube/Local Videos."
@@ -109,19 +252,66 @@ parser.add_argument("--playlist_url", help="URL of a YouTube playlist", default=
 parser.add_argument("--channel_url", help="URL of a YouTube channel", default=None)
 parser.add_argument("--confidence_threshold", help="Confidence threshold for plate detection (0.0 - 1.0)", default=0.5, type=float)
 parser.add_argument("--frame_skip", help="Number of frames to skip between detection attempts", default=5, type=int)
+parser.add_argument("--devices", help="Comma separated devices for detection, one model replica each (e.g. cuda:0,cuda:1 or cpu,cpu). Defaults to all GPUs", default=None)
+parser.add_argument("--cpu_replicas", help="Number of model replicas on hosts without a GPU", default=None, type=int)
+parser.add_argument("--cpu_threads", help="Number of torch threads per CPU replica. Defaults to the CPU cores divided over the replicas", default=None, type=int)
+parser.add_argument("--batch_size", help="Number of frames per detector batch", default=video_reader.batch_size, type=int)
+parser.add_argument("--auto_batch", help="Tune batch size and queue depth from measured throughput, and remember the result for this host and model", action="store_true")
+parser.add_argument("--retune", help="With --auto_batch, ignore the remembered batch size and measure again", action="store_true")
+parser.add_argument("--max_batch_latency", help="With --auto_batch, maximum seconds a single batch may take", default=None, type=float)
+parser.add_argument("--memory_limit_mb", help="With --auto_batch, memory budget in MB for the frames being buffered and detected", default=config.BATCH_MEMORY_LIMIT_MB, type=float)
 parser.add_argument("--force", help="Force reprocessing without asking if video was processed before", action="store_true")
 parser.add_argument("--skip", help="Skip processing if video already exists in DB without prompting", action="store_true")
+parser.add_argument("--db", help="SQLite database file or SQLAlchemy database URL, shared by all workers", default=config.DB_PATH)
+parser.add_argument("--enqueue", help="Add the given video sources to the job queue instead of processing them", action="store_true")
+parser.add_argument("--worker", help="Process jobs from the job queue without prompting", action="store_true")
+parser.add_argument("--workers", help="Number of worker processes to start on this host (implies --worker)", default=None, type=int)
+parser.add_argument("--max_attempts", help="Number of times a queued job is tried before it is marked as failed", default=3, type=int)
+parser.add_argument("--lease_seconds", help="Seconds a worker holds a job before another worker may take it over", default=600, type=int)
+parser.add_argument("--poll_interval", help="Seconds a worker waits when no queued job is ready", default=10, type=int)
+parser.add_argument("--retry_backoff", help="Base delay in seconds before a failed job is retried, doubled per attempt", default=30, type=int)
+parser.add_argument("--keep_polling", help="Keep workers running when the job queue is empty", action="store_true")
 
 args = parser.parse_args()
+video_reader.batch_size = args.batch_size
+
+# Keyword arguments for make_batch_tuner, or None for the fixed batch size
+batch_tuning = None
+if args.auto_batch:
+    batch_tuning = dict(
+        batch_size=args.batch_size,
+        max_latency=args.max_batch_latency,
+        memory_limit_mb=args.memory_limit_mb,
+        retune=args.retune
+    )
+
+if args.workers:
+    sys.exit(start_local_workers(args.workers, args))
+
+# Initialize database session once for all processing
+db_session = db_utils.init_db(args.db)
+
+if args.worker:
+    job_worker.run_worker(
+        db_session,
+        lambda job, lease_lost: process_job(
+            db_session, job, lease_lost, args.confidence_threshold, args.frame_skip, args.devices, args.cpu_replicas,
+            args.cpu_threads, batch_tuning
+        ),
+        lease_seconds=args.lease_seconds,
+        poll_interval=args.poll_interval,
+        backoff_seconds=args.retry_backoff,
+        exit_when_empty=not args.keep_polling
+    )
+    print(f"[INFO] Job queue status: {job_queue.job_counts(db_session)}")
+    db_session.close()
+    sys.exit(0)
 
 # Ensure at least one video source is provided
 if not any([args.video_url, args.video_path, args.video_list_file, args.playlist_url, args.channel_url]):
     print("Error: Must provide at least one video source (--video_url, --video_path, --video_list_file, --playlist_url, or --channel_url).")
     sys.exit(1)
 
-# Initialize database session once for all processing
-db_session = db_utils.init_db(config.DB_PATH)
-
 # Aggregate video URLs from various sources
 video_sources = []  # List of tuples (video_url, video_path)
 
@@ -156,6 +346,29 @@ if args.channel_url:
 if args.video_url or args.video_path:
     video_sources.append((args.video_url, args.video_path))
 
+if args.enqueue:
+    queued = 0
+    for video_url, video_path in video_sources:
+        if args.skip and db_session.query(Video).filter(
+            (Video.url == video_url) if video_url else (Video.local_path == video_path)
+        ).first():
+            print(f"Skipping video {video_url or video_path} because it was processed before and --skip is enabled.")
+            continue
+        job_id = job_queue.enqueue_job(
+            db_session,
+            url=video_url,
+            local_path=os.path.abspath(video_path) if video_path else None,
+            max_attempts=args.max_attempts,
+            force=args.force
+        )
+        if job_id is None:
+            print(f"[INFO] Already queued: {video_url or video_path}")
+        else:
+            queued += 1
+    print(f"[INFO] Queued {queued} video(s). Job queue status: {job_queue.job_counts(db_session)}")
+    db_session.close()
+    sys.exit(0)
+
 # Process each video in the aggregated list
 for video_url, video_path in video_sources:
     print(f"\n[INFO] Starting processing for video: {video_url or video_path}")
@@ -166,7 +379,11 @@ for video_url, video_path in video_sources:
         confidence_threshold=args.confidence_threshold,
         frame_skip=args.frame_skip,
         force=args.force,
-        skip=args.skip
+        skip=args.skip,
+        devices=args.devices,
+        cpu_replicas=args.cpu_replicas,
+        cpu_threads=args.cpu_threads,
+        batch_tuning=batch_tuning
     )
 
 db_session.close()
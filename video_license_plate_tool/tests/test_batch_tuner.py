@@ -0,0 +1,82 @@
+# tests/test_batch_tuner.py
+from db import db_utils
+from db.models import BatchSetting
+from utils.batch_tuner import BatchTuner
+
+def run(tuner, seconds_per_batch, batches=100):
+    """
+    Feed the tuner simulated batch timings until it settles.
+    :param seconds_per_batch: function batch_size -> seconds
+    """
+    for _ in range(batches):
+        if tuner.settled:
+            break
+        tuner.record(tuner.batch_size, seconds_per_batch(tuner.batch_size))
+    return tuner
+
+def test_grows_while_throughput_improves():
+    # Throughput grows with the batch size until the device saturates at 400 frames per second
+    tuner = run(BatchTuner(batch_size=10, samples_per_step=2), lambda size: size / min(10 * size, 400))
+    assert tuner.settled
+    assert tuner.batch_size == 40
+    assert tuner.queue_depth == 80
+
+def test_shrinks_when_larger_batches_are_slower():
+    tuner = run(BatchTuner(batch_size=20, samples_per_step=2), lambda size: 0.01 * size + 0.001 * size ** 2)
+    assert tuner.settled
+    assert tuner.batch_size < 20
+
+def test_respects_latency_limit():
+    tuner = run(BatchTuner(batch_size=10, max_latency=0.4, samples_per_step=2), lambda size: 0.1 + 0.01 * size)
+    assert tuner.settled
+    assert tuner.batch_size == 20
+
+def test_memory_limit_caps_batch_size():
+    tuner = BatchTuner(batch_size=20, memory_limit_mb=30)
+    tuner.limit_frame_size(1920 * 1080 * 3)
+    # 30 MB holds 5 full HD frames, a third of those is the batch
+    assert tuner.batch_size == 1
+
+def test_memory_limit_alone_is_not_persisted():
+    # A persisted optimum capped for a 4K video must not replace the optimum for smaller frames
+    tuner = BatchTuner(batch_size=64, memory_limit_mb=2048, settled=True)
+    tuner.limit_frame_size(3840 * 2160 * 3)
+    assert tuner.batch_size == 28
+    assert not tuner.measured
+
+    tuner.out_of_memory()
+    assert tuner.measured
+
+def test_out_of_memory_halves_batch_size():
+    tuner = BatchTuner(batch_size=20, settled=True)
+    tuner.out_of_memory()
+    assert tuner.batch_size == 10
+    assert tuner.max_batch_size == 10
+
+def test_batch_setting_is_persisted_per_host_and_model():
+    session = db_utils.init_db("sqlite://")
+    db_utils.save_batch_setting(session, "host-a", "model.pt", "cuda:0", 40, 250.0)
+    db_utils.save_batch_setting(session, "host-a", "model.pt", "cuda:0", 20, None)
+
+    setting = db_utils.get_batch_setting(session, "host-a", "model.pt", "cuda:0")
+    assert (setting.batch_size, setting.throughput) == (20, 250.0)
+    assert session.query(BatchSetting).count() == 1
+    assert db_utils.get_batch_setting(session, "host-b", "model.pt", "cuda:0") is None
+
+def test_concurrent_save_updates_the_existing_row(monkeypatch):
+    session = db_utils.init_db("sqlite://")
+    db_utils.save_batch_setting(session, "host-a", "model.pt", "cpu,cpu", 10, 80.0)
+
+    # Simulate a worker that looked for the row before another worker inserted it
+    get_batch_setting = db_utils.get_batch_setting
+    lookups = []
+
+    def missing_first(*args):
+        lookups.append(args)
+        return None if len(lookups) == 1 else get_batch_setting(*args)
+
+    monkeypatch.setattr(db_utils, "get_batch_setting", missing_first)
+    db_utils.save_batch_setting(session, "host-a", "model.pt", "cpu,cpu", 20, 120.0)
+
+    settings = session.query(BatchSetting).all()
+    assert [(s.batch_size, s.throughput) for s in settings] == [(20, 120.0)]
@@ -0,0 +1,112 @@
+# tests/test_job_queue.py
+from datetime import timedelta
+from db import db_utils, job_queue
+from db.models import Job
+from utils.job_worker import run_worker
+
+def make_session():
+    return db_utils.init_db("sqlite://")
+
+def test_enqueue_skips_already_queued_video():
+    session = make_session()
+    assert job_queue.enqueue_job(session, url="https://youtu.be/a") is not None
+    assert job_queue.enqueue_job(session, url="https://youtu.be/a") is None
+    assert job_queue.enqueue_job(session, url="https://youtu.be/a", force=True) is not None
+
+def test_claimed_job_is_not_claimed_again_until_lease_expires():
+    session = make_session()
+    job_id = job_queue.enqueue_job(session, url="https://youtu.be/a")
+
+    job = job_queue.claim_job(session, "host-a:1")
+    assert job.id == job_id
+    assert job.status == job_queue.RUNNING
+    assert job.attempts == 1
+    assert job_queue.claim_job(session, "host-b:1") is None
+
+    job.lease_expires_at = job_queue.db_now(session) - timedelta(seconds=1)
+    session.commit()
+    job = job_queue.claim_job(session, "host-b:1", backoff_seconds=0)
+    assert job.worker_id == "host-b:1"
+    assert job.attempts == 2
+    assert not job_queue.renew_lease(session, job_id, "host-a:1")
+
+def test_expired_leases_count_as_failed_attempts():
+    # A job that kills its worker every time must not be retried forever
+    session = make_session()
+    job_id = job_queue.enqueue_job(session, url="https://youtu.be/crash", max_attempts=2)
+
+    for attempt in range(6):
+        job = job_queue.claim_job(session, f"host-a:{attempt}", backoff_seconds=60)
+        if job is None:
+            job = session.get(Job, job_id)
+            if job.status == job_queue.FAILED:
+                break
+            # Backoff after the expired lease, let it pass
+            assert job.status == job_queue.PENDING
+            assert job.next_attempt_at > job_queue.db_now(session)
+            job.next_attempt_at = job_queue.db_now(session)
+            session.commit()
+            job = job_queue.claim_job(session, f"host-a:{attempt}", backoff_seconds=60)
+        job.lease_expires_at = job_queue.db_now(session) - timedelta(seconds=1)
+        session.commit()
+
+    job_queue.expire_leases(session)
+    job = session.get(Job, job_id)
+    assert job.status == job_queue.FAILED
+    assert job.attempts == 2
+    assert "expired" in job.last_error
+    assert job_queue.claim_job(session, "host-b:1") is None
+
+def test_late_worker_cannot_overwrite_reclaimed_job():
+    session = make_session()
+    job_id = job_queue.enqueue_job(session, url="https://youtu.be/a")
+
+    job = job_queue.claim_job(session, "host-a:1")
+    job.lease_expires_at = job_queue.db_now(session) - timedelta(seconds=1)
+    session.commit()
+    job_queue.claim_job(session, "host-b:1", backoff_seconds=0)
+    assert job_queue.complete_job(session, job_id, "host-b:1", None, 10.0, 60.0)
+    next_attempt_at = session.get(Job, job_id).next_attempt_at
+
+    assert not job_queue.fail_job(session, job_id, "host-a:1", "late failure")
+    assert not job_queue.complete_job(session, job_id, "host-a:1", None, 20.0, 60.0)
+    job = session.get(Job, job_id)
+    assert job.status == job_queue.DONE
+    assert job.processing_seconds == 10.0
+    assert job.next_attempt_at == next_attempt_at
+
+def test_failed_job_is_retried_with_backoff_then_marked_failed():
+    session = make_session()
+    job_id = job_queue.enqueue_job(session, local_path="/videos/a.mp4", max_attempts=2)
+
+    job_queue.claim_job(session, "w")
+    assert job_queue.fail_job(session, job_id, "w", "boom", backoff_seconds=60)
+    job = session.get(Job, job_id)
+    assert job.status == job_queue.PENDING
+    assert job.next_attempt_at > job_queue.db_now(session)
+    assert job_queue.claim_job(session, "w") is None
+
+    job.next_attempt_at = job_queue.db_now(session)
+    session.commit()
+    job_queue.claim_job(session, "w")
+    assert job_queue.fail_job(session, job_id, "w", "boom again")
+    assert session.get(Job, job_id).status == job_queue.FAILED
+
+def test_worker_records_status_and_timing():
+    session = make_session()
+    job_queue.enqueue_job(session, url="https://youtu.be/ok")
+    job_queue.enqueue_job(session, url="https://youtu.be/broken", max_attempts=1)
+
+    def process_job(job, lease_lost):
+        if "broken" in job.url:
+            raise RuntimeError("download failed")
+        return None, 12.5, 60.0
+
+    assert run_worker(session, process_job, worker_id="w", poll_interval=0) == 1
+    ok, broken = session.query(Job).order_by(Job.id).all()
+    assert ok.status == job_queue.DONE
+    assert ok.processing_seconds == 12.5
+    assert ok.video_duration == 60.0
+    assert broken.status == job_queue.FAILED
+    assert "download failed" in broken.last_error
+    assert job_queue.job_counts(session) == {"pending": 0, "running": 0, "done": 1, "failed": 1}
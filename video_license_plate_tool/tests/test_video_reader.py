@@ -0,0 +1,74 @@
+# tests/test_video_reader.py
+import threading
+import numpy as np
+import pytest
+from utils import video_reader
+from utils.batch_tuner import BatchTuner
+
+class FakeCapture:
+    """
+    Stands in for cv2.VideoCapture with a number of full HD frames.
+    """
+    def __init__(self, frames, shape=(1080, 1920, 3)):
+        self.frames = frames
+        self.shape = shape
+        self.released = False
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return 25.0
+
+    def read(self):
+        if self.frames == 0:
+            return False, None
+        self.frames -= 1
+        return True, np.zeros(self.shape, dtype=np.uint8)
+
+    def release(self):
+        self.released = True
+
+class FakeDetector:
+    def __init__(self):
+        self.batches = []
+
+    def detect_batch(self, frames):
+        self.batches.append(len(frames))
+        return [[] for _ in frames]
+
+def test_memory_limit_shrinks_queue_of_settled_tuner(monkeypatch):
+    monkeypatch.setattr(video_reader.cv2, "VideoCapture", lambda path: FakeCapture(30))
+    resized = []
+    resize_queue = video_reader.resize_queue
+
+    def record_resize(frame_queue, maxsize):
+        resized.append(maxsize)
+        resize_queue(frame_queue, maxsize)
+
+    monkeypatch.setattr(video_reader, "resize_queue", record_resize)
+
+    # A persisted batch size of 20 with a budget of 9 full HD frames in flight
+    tuner = BatchTuner(batch_size=20, memory_limit_mb=9 * 1920 * 1080 * 3 / (1024 * 1024), settled=True)
+    detector = FakeDetector()
+    assert video_reader.process_video("video.mp4", detector, None, None, 1, frame_skip=1, tuner=tuner)
+
+    assert tuner.batch_size == 3
+    assert resized[0] == 6
+    assert set(detector.batches) == {3}
+
+class FailingDetector:
+    def detect_batch(self, frames):
+        raise RuntimeError("detector failed")
+
+def test_failed_batch_stops_loader_and_releases_capture(monkeypatch):
+    capture = FakeCapture(1000, shape=(4, 4, 3))
+    monkeypatch.setattr(video_reader.cv2, "VideoCapture", lambda path: capture)
+    threads = threading.active_count()
+
+    with pytest.raises(RuntimeError):
+        video_reader.process_video("video.mp4", FailingDetector(), None, None, 1, frame_skip=1)
+
+    assert capture.released
+    assert capture.frames > 0  # the loader stopped before the end of the video
+    assert threading.active_count() == threads
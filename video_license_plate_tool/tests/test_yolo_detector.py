@@ -0,0 +1,159 @@
+# tests/test_yolo_detector.py
+import threading
+import time
+import numpy as np
+import pytest
+from detectors import yolo_detector
+from detectors.yolo_detector import YoloPlateDetector, resolve_devices, split_devices
+
+class FakeBox:
+    def __init__(self, value):
+        self.xyxy = [FakeTensor([value, value, value + 1, value + 1])]
+        self.conf = [FakeTensor(0.9)]
+
+class FakeTensor:
+    def __init__(self, value):
+        self.value = value
+
+    def tolist(self):
+        return self.value
+
+    def item(self):
+        return self.value
+
+class FakeResult:
+    def __init__(self, frame):
+        self.boxes = [FakeBox(float(frame[0, 0, 0]))]
+
+class FakeModule:
+    def to(self, device):
+        return self
+
+    def half(self):
+        return self
+
+class FakePredictor:
+    """
+    Stands in for DevicePredictor and records the device the model was set up on.
+    """
+
+    def __init__(self, device, overrides=None, _callbacks=None):
+        self.fixed_device = device
+        self.device = None
+
+    def setup_model(self, model, verbose=True):
+        self.model = model
+        self.device = self.fixed_device
+
+class FakeYOLO:
+    """
+    Stands in for ultralytics.YOLO and records which replica ran each shard, and on which device.
+    """
+    calls = []
+
+    def __init__(self, model_path):
+        self.model = FakeModule()
+        self.callbacks = {}
+        self.predictor = None
+
+    def predict(self, source, imgsz, conf):
+        FakeYOLO.calls.append((id(self), threading.get_ident(), len(source), self.predictor.device))
+        # Take some time like a real model, so the other replicas get to take shards too
+        time.sleep(0.02)
+        return [FakeResult(frame) for frame in source]
+
+def use_fake_models(monkeypatch, yolo=FakeYOLO):
+    monkeypatch.setattr(yolo_detector, "YOLO", yolo)
+    monkeypatch.setattr(yolo_detector, "DevicePredictor", FakePredictor)
+    threads = []
+    monkeypatch.setattr(yolo_detector.torch, "set_num_threads", threads.append)
+    return threads
+
+def make_frames(count):
+    return [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(count)]
+
+def test_resolve_devices():
+    assert resolve_devices("0,1") == ["cuda:0", "cuda:1"]
+    assert resolve_devices(["cpu", "cpu"]) == ["cpu", "cpu"]
+    assert resolve_devices("cpu", cpu_replicas=3) == ["cpu", "cpu", "cpu"]
+
+def test_split_devices_between_workers(monkeypatch):
+    monkeypatch.setattr(yolo_detector.os, "cpu_count", lambda: 16)
+    assert split_devices(["cuda:0", "cuda:1", "cuda:2"], 2) == [(["cuda:0", "cuda:2"], None), (["cuda:1"], None)]
+    assert split_devices(["cuda:0"], 2) == [(["cuda:0"], None), (["cuda:0"], None)]
+    # 4 CPU replicas over 2 workers share the 16 cores instead of each worker using all of them
+    assert split_devices(["cpu"] * 4, 2) == [(["cpu", "cpu"], 4), (["cpu", "cpu"], 4)]
+
+def test_batches_are_sharded_over_cpu_replicas(monkeypatch):
+    threads = use_fake_models(monkeypatch)
+    FakeYOLO.calls = []
+
+    detector = YoloPlateDetector(devices=["cpu", "cpu"], cpu_threads=1)
+    detections = detector.detect_batch(make_frames(10), shard_size=3)
+    detector.close()
+
+    # Results come back in frame order, whichever replica handled the shard
+    assert [d[0][0] for d in detections] == [float(i) for i in range(10)]
+    assert sum(frames for _, _, frames, _ in FakeYOLO.calls) == 10
+    assert len(FakeYOLO.calls) == 4
+    # Both replicas took shards
+    assert len({replica for replica, _, _, _ in FakeYOLO.calls}) == 2
+    assert threads == [1]
+
+def test_each_replica_predicts_on_its_own_device(monkeypatch):
+    use_fake_models(monkeypatch)
+    FakeYOLO.calls = []
+
+    detector = YoloPlateDetector(devices="cuda:0,cuda:1")
+    detector.detect_batch(make_frames(8), shard_size=1)
+    detector.close()
+
+    # Every replica model ran on the device it was created for, not on the default GPU
+    devices = {replica.device for replica in detector.replicas}
+    assert devices == {yolo_detector.torch.device("cuda:0"), yolo_detector.torch.device("cuda:1")}
+    for replica in detector.replicas:
+        assert replica.model.predictor.device == replica.device
+        assert replica.model.predictor.model is replica.model.model
+    replica_devices = {id(replica.model): replica.device for replica in detector.replicas}
+    assert {device for _, _, _, device in FakeYOLO.calls} == devices
+    assert all(device == replica_devices[model] for model, _, _, device in FakeYOLO.calls)
+
+def test_single_replica_runs_inline(monkeypatch):
+    use_fake_models(monkeypatch)
+    FakeYOLO.calls = []
+
+    detector = YoloPlateDetector(devices="cpu")
+    assert detector.detect_plates(make_frames(1)[0])[0][4] == 0.9
+    assert FakeYOLO.calls[0][1] == threading.get_ident()
+
+class FailingYOLO(FakeYOLO):
+    """
+    The first replica fails shortly after starting, the others take longer to finish their shard.
+    """
+    instances = 0
+    finished = []
+
+    def __init__(self, model_path):
+        super().__init__(model_path)
+        self.fails = FailingYOLO.instances == 0
+        FailingYOLO.instances += 1
+
+    def predict(self, source, imgsz, conf):
+        if self.fails:
+            time.sleep(0.05)
+            raise RuntimeError("CUDA out of memory")
+        time.sleep(0.2)
+        FailingYOLO.finished.append(len(source))
+        return [FakeResult(frame) for frame in source]
+
+def test_failed_shard_waits_for_other_replicas(monkeypatch):
+    use_fake_models(monkeypatch, FailingYOLO)
+    FailingYOLO.instances = 0
+    FailingYOLO.finished = []
+
+    detector = YoloPlateDetector(devices=["cpu", "cpu"])
+    with pytest.raises(RuntimeError):
+        detector.detect_batch(make_frames(4))
+    # The other replica's shard was done before the error reached the caller
+    assert FailingYOLO.finished == [2]
+    detector.close()
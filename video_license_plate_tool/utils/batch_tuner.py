@@ -0,0 +1,141 @@
+# utils/batch_tuner.py
+
+class BatchTuner:
+    """
+    Picks the detector batch size by measuring throughput at run time.
+    Starting from the initial size it doubles the batch while throughput improves, then tries halving it,
+    and settles on the fastest size that stays within the latency and memory limits.
+    The frame queue depth follows the batch size.
+    """
+
+    def __init__(self, batch_size=20, min_batch_size=1, max_batch_size=128, max_latency=None,
+                 memory_limit_mb=None, samples_per_step=3, tolerance=0.05, settled=False):
+        """
+        :param batch_size: int, batch size to start with
+        :param min_batch_size: int
+        :param max_batch_size: int
+        :param max_latency: float, maximum seconds a single batch may take, or None for no limit
+        :param memory_limit_mb: float, memory budget for the frames in flight (batch plus queue), or None for no limit
+        :param samples_per_step: int, batches measured per batch size (after one warm-up batch)
+        :param tolerance: float, relative throughput gain needed to prefer another batch size
+        :param settled: bool, start with batch_size without exploring (e.g. a persisted optimum)
+        """
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.memory_limit_mb = memory_limit_mb
+        self.samples_per_step = samples_per_step
+        self.tolerance = tolerance
+
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+        self.initial_batch_size = self.batch_size
+        self.settled = settled
+        self.direction = 2  # factor for the next batch size; 2 while growing, 0.5 while shrinking
+        self.results = {}  # batch size -> (frames per second, seconds per batch)
+        self.best_batch_size = self.batch_size if settled else None
+        self.out_of_memory_seen = False
+        self._samples = []
+        self._warmed_up = False
+
+    @property
+    def queue_depth(self):
+        """
+        Number of frames the loader may buffer ahead of the detector.
+        """
+        return self.batch_size * 2
+
+    @property
+    def throughput(self):
+        """
+        Measured frames per second at the best batch size, or None.
+        """
+        if self.best_batch_size in self.results:
+            return self.results[self.best_batch_size][0]
+        return None
+
+    @property
+    def measured(self):
+        """
+        True if the batch size follows from measurements or an out of memory error, and is worth persisting.
+        A cap from the memory budget only holds for this video's frame size, so it does not count.
+        """
+        return bool(self.results) or self.out_of_memory_seen
+
+    def limit_frame_size(self, frame_bytes):
+        """
+        Cap the batch size so the batch and the queue fit in the memory budget.
+        :param frame_bytes: int, size of one decoded frame
+        """
+        if not self.memory_limit_mb or not frame_bytes:
+            return
+        frames_in_flight = int(self.memory_limit_mb * 1024 * 1024 // frame_bytes)
+        # The batch itself plus a queue of twice the batch size
+        self.max_batch_size = max(self.min_batch_size, min(self.max_batch_size, frames_in_flight // 3))
+        self.batch_size = min(self.batch_size, self.max_batch_size)
+
+    def out_of_memory(self, failed_batch_size=None):
+        """
+        Halve the batch size after the device ran out of memory and never try larger sizes again.
+        :param failed_batch_size: int, size of the batch that failed, defaults to the current batch size
+        """
+        failed_batch_size = failed_batch_size or self.batch_size
+        self.out_of_memory_seen = True
+        self.max_batch_size = max(self.min_batch_size, min(self.max_batch_size, failed_batch_size // 2))
+        self.batch_size = min(self.batch_size, self.max_batch_size)
+        if self.best_batch_size is not None:
+            self.best_batch_size = min(self.best_batch_size, self.max_batch_size)
+        self._samples = []
+        self._warmed_up = False
+        if self.direction > 1:
+            self.direction = 0.5
+
+    def record(self, frames, seconds):
+        """
+        Record the detector time of one batch and move to the next batch size when enough batches were measured.
+        :param frames: int, number of frames in the batch
+        :param seconds: float, time the detector took for the batch
+        """
+        if self.settled or frames != self.batch_size:
+            return
+        if not self._warmed_up:
+            # The first batch of a new size includes allocation and warm-up cost
+            self._warmed_up = True
+            return
+
+        self._samples.append(seconds)
+        if len(self._samples) < self.samples_per_step:
+            return
+
+        latency = sum(self._samples) / len(self._samples)
+        throughput = self.batch_size / latency if latency > 0 else float("inf")
+        self.results[self.batch_size] = (throughput, latency)
+        self._samples = []
+        self._warmed_up = False
+
+        too_slow = self.max_latency is not None and latency > self.max_latency
+        improved = not too_slow and (self.throughput is None or throughput > self.throughput * (1 + self.tolerance))
+        if improved:
+            self.best_batch_size = self.batch_size
+        self._next_step(improved, too_slow)
+
+    def _next_step(self, improved, too_slow):
+        if too_slow and self.best_batch_size is None:
+            # Even the first size is over the latency limit, only smaller batches can help
+            self.direction = 0.5
+            next_size = self.batch_size // 2
+        elif improved:
+            next_size = int(self.batch_size * self.direction)
+        elif self.direction > 1 and self.best_batch_size == self.initial_batch_size:
+            # Growing did not help from the start, try smaller batches instead
+            self.direction = 0.5
+            next_size = self.best_batch_size // 2
+        else:
+            next_size = None
+
+        if next_size is not None:
+            next_size = min(max(next_size, self.min_batch_size), self.max_batch_size)
+        if next_size is None or next_size in self.results:
+            self.batch_size = self.best_batch_size or self.batch_size
+            self.settled = True
+        else:
+            self.batch_size = next_size
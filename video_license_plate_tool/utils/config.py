@@ -7,3 +7,6 @@ DB_PATH = os.path.join(os.getcwd(), "license_plate_data.db")
 
 # Default YOLO model path (replace with your own trained model)
 DEFAULT_MODEL_PATH = "models/license_plate_detector.pt"
+
+# Memory budget (MB) for decoded frames in flight when the batch size is tuned automatically
+BATCH_MEMORY_LIMIT_MB = 2048
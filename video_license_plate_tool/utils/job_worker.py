@@ -0,0 +1,97 @@
+# utils/job_worker.py
+
+import os
+import socket
+import threading
+import time
+import traceback
+from sqlalchemy.orm import sessionmaker
+
+from db import db_utils, job_queue
+
+
+def default_worker_id():
+    """
+    Identify this worker by host name and process id.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def lease_heartbeat(engine, job_id, worker_id, lease_seconds, stop_event, lease_lost):
+    """
+    Renew the lease of a running job until stop_event is set.
+    Sets lease_lost when another worker took over the job.
+    Runs in its own thread with its own session, because sessions are not thread safe.
+    """
+    session = sessionmaker(bind=engine)()
+    try:
+        while not stop_event.wait(lease_seconds / 3):
+            try:
+                if not job_queue.renew_lease(session, job_id, worker_id, lease_seconds):
+                    print(f"[WARN] Lost lease on job {job_id}, stopping")
+                    lease_lost.set()
+                    break
+            except Exception as e:
+                session.rollback()
+                print(f"[WARN] Unable to renew lease on job {job_id}: {e}")
+    finally:
+        session.close()
+
+def run_worker(db_session, process_job, worker_id=None, lease_seconds=600, poll_interval=10,
+               backoff_seconds=30, exit_when_empty=True):
+    """
+    Claim and process jobs from the queue until it is empty.
+    :param db_session: DB session used for queue bookkeeping
+    :param process_job: function that takes a Job and a threading.Event, and returns (video_id, processing_seconds, video_duration).
+                        The event is set when the lease was lost; processing should then stop as soon as possible.
+    :param worker_id: str, defaults to host:pid
+    :param lease_seconds: int, lease length; the lease is renewed while the job runs
+    :param poll_interval: int, seconds to wait when no job is runnable yet
+    :param backoff_seconds: int, base delay before a failed job is retried
+    :param exit_when_empty: bool, stop once no jobs are pending or running, otherwise keep polling
+    :return: int, number of jobs this worker completed
+    """
+    worker_id = worker_id or default_worker_id()
+    engine = db_session.get_bind()
+    completed = 0
+
+    while True:
+        job = job_queue.claim_job(db_session, worker_id, lease_seconds=lease_seconds, backoff_seconds=backoff_seconds)
+        if job is None:
+            if exit_when_empty and not job_queue.has_unfinished_jobs(db_session):
+                break
+            time.sleep(poll_interval)
+            continue
+
+        job_id = job.id
+        print(f"\n[INFO] Worker {worker_id} claimed job {job_id} (attempt {job.attempts}/{job.max_attempts}): {job.url or job.local_path}")
+
+        stop_event = threading.Event()
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=lease_heartbeat,
+            args=(engine, job_id, worker_id, lease_seconds, stop_event, lease_lost)
+        )
+        heartbeat.daemon = True
+        heartbeat.start()
+
+        try:
+            video_id, processing_seconds, video_duration = process_job(job, lease_lost)
+        except Exception as e:
+            db_session.rollback()
+            print(f"[ERROR] Job {job_id} failed: {e}")
+            if not job_queue.fail_job(db_session, job_id, worker_id, traceback.format_exc(), backoff_seconds=backoff_seconds):
+                print(f"[WARN] Job {job_id} is no longer leased by this worker, failure not recorded")
+        else:
+            if job_queue.complete_job(db_session, job_id, worker_id, video_id, processing_seconds, video_duration):
+                completed += 1
+                print(f"[INFO] Job {job_id} done in {processing_seconds:.1f}s")
+            else:
+                # Another worker owns the job now, so its results are the ones to keep
+                print(f"[WARN] Job {job_id} is no longer leased by this worker, dropping its result")
+                db_utils.delete_video_record(db_session, video_id)
+        finally:
+            stop_event.set()
+            heartbeat.join()
+
+    print(f"[INFO] Worker {worker_id} finished, {completed} job(s) completed.")
+    return completed
@@ -6,13 +6,14 @@ import json
 import logging
 import queue
 import threading
+import time
 
 
 batch_size = 20
 
-def frame_loader(cap, frame_queue, frame_skip):
+def frame_loader(cap, frame_queue, frame_skip, stop_event=None):
     frame_count = 0
-    while True:
+    while stop_event is None or not stop_event.is_set():
         ret, frame = cap.read()
         if not ret:
             break
@@ -28,7 +29,56 @@ def is_valid_plate(text):
     # return bool(pattern.match(text))
     return len(text) == 6
 
-def process_video(video_path, detector, ocr_function, db_session, video_id, frame_skip=5):
+def process_batch(batch_frames, batch_indices, fps, detector, ocr_function, db_session, video_id, tuner=None):
+    """
+    Detect plates in a batch of frames, run OCR on them and insert the valid plates into the DB.
+    With a tuner the detector time is recorded, and a batch that runs out of device memory is split up.
+    """
+    start = time.perf_counter()
+    try:
+        detections_list = detector.detect_batch(batch_frames)
+    except RuntimeError as e:
+        if tuner is None or "out of memory" not in str(e) or len(batch_frames) == 1:
+            raise
+        tuner.out_of_memory(len(batch_frames))
+        print(f"[WARN] Out of memory with batch size {len(batch_frames)}, continuing with {tuner.batch_size}")
+        i = 0
+        while i < len(batch_frames):
+            # The batch size may shrink further while the chunks are processed
+            step = tuner.batch_size
+            process_batch(batch_frames[i:i + step], batch_indices[i:i + step],
+                          fps, detector, ocr_function, db_session, video_id, tuner)
+            i += step
+        return
+    if tuner is not None:
+        tuner.record(len(batch_frames), time.perf_counter() - start)
+
+    for b_idx, detections in enumerate(detections_list):
+        ts = batch_indices[b_idx] / fps
+        for (x1, y1, x2, y2, conf) in detections:
+            plate_crop = batch_frames[b_idx][int(y1):int(y2), int(x1):int(x2)]
+            plate_text = ocr_function(plate_crop)
+            if plate_text and is_valid_plate(plate_text):
+                print(f"Detected plate: {plate_text} | Confidence: {conf}")
+                bbox_dict = {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)}
+                insert_plate_record(
+                    session=db_session,
+                    video_id=video_id,
+                    timestamp=ts,
+                    plate_text=plate_text,
+                    confidence=float(conf),
+                    bbox=json.dumps(bbox_dict)
+                )
+
+def resize_queue(frame_queue, maxsize):
+    """
+    Change the capacity of a running frame queue and wake up a blocked loader.
+    """
+    with frame_queue.mutex:
+        frame_queue.maxsize = maxsize
+        frame_queue.not_full.notify_all()
+
+def process_video(video_path, detector, ocr_function, db_session, video_id, frame_skip=5, tuner=None, stop_event=None):
     """
     Iterate through video frames, detect plates, run OCR, and insert results into DB.
     :param video_path: str, path to local video
@@ -37,72 +87,71 @@ def process_video(video_path, detector, ocr_function, db_session, video_id, fram
     :param db_session: DB session for inserts
     :param video_id: int, ID of the corresponding video in DB
     :param frame_skip: int, how many frames to skip between detections
+    :param tuner: optional BatchTuner that adjusts batch size and queue depth while processing.
+                  Without a tuner the module level batch_size is used.
+    :param stop_event: optional threading.Event; when it is set, processing stops after the current batch
+    :return: bool, False if processing was stopped before the end of the video
     """
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"[ERROR] Cannot open video: {video_path}")
-        return
+        return False
 
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_queue = queue.Queue(maxsize=batch_size * 2)  # Buffer size can be adjusted
-    loader_thread = threading.Thread(target=frame_loader, args=(cap, frame_queue, frame_skip))
+    current_batch_size = tuner.batch_size if tuner else batch_size
+    queue_depth = tuner.queue_depth if tuner else batch_size * 2
+    frame_queue = queue.Queue(maxsize=queue_depth)  # Buffer size can be adjusted
+    loader_stop = threading.Event()
+    loader_thread = threading.Thread(target=frame_loader, args=(cap, frame_queue, frame_skip, loader_stop))
     loader_thread.daemon = True  # Ensures thread exits if main program exits
     loader_thread.start()
 
-    frame_count = 0
     batch_frames = []
     batch_indices = []
+    loader_done = False
+    stopped = False
 
-    while True:
-        item = frame_queue.get()  # Retrieve frame from queue
-        if item is None:
-            # No more frames to process
-            break
-        idx, frame = item
-        batch_frames.append(frame)
-        batch_indices.append(idx)
-
-        if len(batch_frames) == batch_size:
-            # Process batch as before
-            detections_list = detector.detect_batch(batch_frames)
-            for b_idx, detections in enumerate(detections_list):
-                ts = batch_indices[b_idx] / fps
-                for (x1, y1, x2, y2, conf) in detections:
-                    plate_crop = batch_frames[b_idx][int(y1):int(y2), int(x1):int(x2)]
-                    plate_text = ocr_function(plate_crop)
-                    if plate_text and is_valid_plate(plate_text):
-                        print(f"Detected plate: {plate_text} | Confidence: {conf}")
-                        bbox_dict = {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)}
-                        insert_plate_record(
-                            session=db_session,
-                            video_id=video_id,
-                            timestamp=ts,
-                            plate_text=plate_text,
-                            confidence=float(conf),
-                            bbox=json.dumps(bbox_dict)
-                        )
-            batch_frames.clear()
-            batch_indices.clear()
-
-    # Process remaining frames in batch_frames if any
-    if batch_frames:
-        detections_list = detector.detect_batch(batch_frames)
-        for b_idx, detections in enumerate(detections_list):
-            ts = batch_indices[b_idx] / fps
-            for (x1, y1, x2, y2, conf) in detections:
-                plate_crop = batch_frames[b_idx][int(y1):int(y2), int(x1):int(x2)]
-                plate_text = ocr_function(plate_crop)
-                if plate_text and is_valid_plate(plate_text):
-                    print(f"Detected plate: {plate_text} | Confidence: {conf}")
-                    bbox_dict = {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)}
-                    insert_plate_record(
-                        session=db_session,
-                        video_id=video_id,
-                        timestamp=ts,
-                        plate_text=plate_text,
-                        confidence=float(conf),
-                        bbox=json.dumps(bbox_dict)
-                    )
-
-    cap.release()
-    loader_thread.join()  # Ensure the loader thread finishes
+    try:
+        while True:
+            item = frame_queue.get()  # Retrieve frame from queue
+            if item is None:
+                # No more frames to process
+                loader_done = True
+                break
+            idx, frame = item
+            if tuner and idx == 0:
+                # The frame size is only known now, so the memory budget may shrink the queue created above
+                tuner.limit_frame_size(frame.nbytes)
+                current_batch_size = tuner.batch_size
+                resize_queue(frame_queue, tuner.queue_depth)
+            batch_frames.append(frame)
+            batch_indices.append(idx)
+
+            if len(batch_frames) >= current_batch_size:
+                process_batch(batch_frames, batch_indices, fps, detector, ocr_function, db_session, video_id, tuner)
+                batch_frames.clear()
+                batch_indices.clear()
+
+                if stop_event is not None and stop_event.is_set():
+                    stopped = True
+                    break
+
+                if tuner and tuner.batch_size != current_batch_size:
+                    current_batch_size = tuner.batch_size
+                    resize_queue(frame_queue, tuner.queue_depth)
+                    print(f"[INFO] Batch size {current_batch_size}, queue depth {tuner.queue_depth}")
+
+        # Process remaining frames in batch_frames if any
+        if batch_frames and not stopped:
+            process_batch(batch_frames, batch_indices, fps, detector, ocr_function, db_session, video_id, tuner)
+    finally:
+        # Also when stopped early or when a batch failed: stop the loader, and let it
+        # reach its sentinel, so the thread, the capture and the buffered frames are freed
+        loader_stop.set()
+        if not loader_done:
+            while frame_queue.get() is not None:
+                pass
+        loader_thread.join()  # Ensure the loader thread finishes
+        cap.release()
+
+    return not stopped